@@ -4,12 +4,13 @@ from datetime import datetime
 import logging
 import os
 import time
+from sites import load_registry
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BUCKET_NAME = 'headlines2025'
-SITES ={'eltiempo': 'https://www.eltiempo.com','publimetro': 'https://www.publimetro.co'}
+REGISTRY = load_registry()
 
 def download_and_save_to_s3(site_name, url):
     try:
@@ -38,8 +39,8 @@ def download_and_save_to_s3(site_name, url):
     
 def lambda_handler(event, context):
     results = {}
-    for site_name, url in SITES.items():
-        results[site_name] = download_and_save_to_s3(site_name, url)
+    for site in REGISTRY:
+        results[site.name] = download_and_save_to_s3(site.key_prefix, site.url)
     return {
         'statusCode': 200,
         'body': results
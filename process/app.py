@@ -6,8 +6,73 @@ from bs4 import BeautifulSoup
 import re
 from datetime import datetime
 import unicodedata
+from botocore.exceptions import BotoCoreError, ClientError
+from sites import load_registry
+from snapshots import construir_indice, diff_snapshots
 
 s3 = boto3.client('s3')
+REGISTRY = load_registry()
+
+CAMPOS_NOTICIA = ['Categoria', 'Titular', 'Enlace', 'Posicion']
+CAMPOS_CAMBIO = ['Cambio', 'Categoria', 'Titular', 'Enlace', 'PosicionAnterior', 'Posicion', 'Permanencia']
+
+
+def snapshot_key(periodico):
+    return f'snapshots/periodico={periodico}/ultimo.json'
+
+
+def _es_numero(valor):
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+
+def _snapshot_valido(snapshot):
+    if not isinstance(snapshot, dict) or not _es_numero(snapshot.get('capturado')):
+        return False
+    noticias = snapshot.get('noticias')
+    if not isinstance(noticias, dict):
+        return False
+    for noticia in noticias.values():
+        if not isinstance(noticia, dict) or 'Categoria' not in noticia or 'Titular' not in noticia:
+            return False
+        if not _es_numero(noticia.get('Posicion')) or not _es_numero(noticia.get('PrimeraVez')):
+            return False
+    return True
+
+
+def cargar_snapshot(bucket_name, periodico):
+    """
+    Lee el último índice guardado del periódico. Retorna None si todavía no
+    existe ninguno (primera captura) o si el guardado está dañado, para que
+    se vuelva a sembrar. Los errores de S3 se propagan.
+    """
+    key = snapshot_key(periodico)
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+    contenido = response['Body'].read()
+
+    try:
+        snapshot = json.loads(contenido.decode('utf-8'))
+    except ValueError as e:
+        print(f"La captura anterior {key} no es un JSON válido ({e}); se vuelve a sembrar.")
+        return None
+    if not _snapshot_valido(snapshot):
+        print(f"La captura anterior {key} no tiene el formato esperado; se vuelve a sembrar.")
+        return None
+    return snapshot
+
+
+def generar_csv(filas, campos):
+    csv_buffer = io.StringIO()
+    escritor = csv.DictWriter(csv_buffer, fieldnames=campos)
+    escritor.writeheader()
+    for fila in filas:
+        escritor.writerow(fila)
+    return csv_buffer.getvalue().encode('utf-8')
+
 
 def lambda_handler(event, context):
 
@@ -20,7 +85,13 @@ def lambda_handler(event, context):
         if not object_key.lower().endswith('.html'):
             print(f"El objeto {object_key} no es un HTML; se omite.")
             continue
-        
+
+        # Enrutar la key al sitio registrado por su prefijo
+        site = REGISTRY.for_key(object_key)
+        if site is None:
+            print(f"El objeto {object_key} no corresponde a ningún sitio registrado; se omite.")
+            continue
+
         try:
             # 2. Descargar el contenido del archivo HTML desde S3
             response = s3.get_object(Bucket=bucket_name, Key=object_key)
@@ -31,85 +102,79 @@ def lambda_handler(event, context):
             print(f"Error al descargar {object_key} de {bucket_name}: {e}")
             continue
         
-        # 3. Parsear con BeautifulSoup
+        # 3. Parsear con las reglas del sitio
         soup = BeautifulSoup(html_content, 'html.parser')
         noticias = []
-        if re.search(r'(?i)\beltiempo\b', object_key):
-            base_url = "https://www.eltiempo.com"
-            for article in soup.find_all('article'):
-                t = article.find(['h2', 'h3'])
-                a = article.find('a', href=True)
-                
-                if not t or not a:
-                    continue
-                titular = t.get_text(strip=True)
-                texto_nfd = unicodedata.normalize('NFD', titular)
-                titular_sin_tildes = re.sub(r'[\u0300-\u036f]', '', texto_nfd)
-                titulo_sin_caracteres = re.sub(r'[^A-Za-z0-9\s]', '', titular_sin_tildes)
-                titular_final = re.sub(r",", " ", titulo_sin_caracteres)
-                enlace = a['href']
-            
-                if not enlace.startswith('http'):
-                    enlace = base_url + enlace
-                parts = enlace.split('/')
-                categoria = parts[3] if len(parts) > 3 else ''
-                noticias.append({
-                    'Categoria': categoria,
-                    'Titular': titular_final,
-                    'Enlace': enlace
-                })
-            periodico='eltiempo'
-        elif re.search(r'(?i)\bpublimetro\b', object_key):
-            base_url = "https://www.publimetro.co"
-            for article in soup.find_all(['h2','h3'], class_='c-heading'):
-                t = article.find(['a'])
-                a = article.find('a', href=True)
-                
-                if not a:
-                    continue
-                titular = t.get_text(strip=True)
-                texto_nfd = unicodedata.normalize('NFD', titular)
-                titular_sin_tildes = re.sub(r'[\u0300-\u036f]', '', texto_nfd)
-                titulo_sin_caracteres = re.sub(r'[^A-Za-z0-9\s]', '', titular_sin_tildes)
-                titular_final = re.sub(r",", " ", titulo_sin_caracteres)
-                enlace = a['href']
-                
-                if not enlace.startswith('http') and base_url:
-                    enlace = base_url + enlace
-            
-                parts = enlace.split('/')
-                categoria = parts[3] if len(parts) > 3 else ''
-                noticias.append({
-                    'Categoria': categoria,
-                    'Titular': titular_final,
-                    'Enlace': enlace
-                })
-            periodico='publimetro'
-        else:
-            return None
-        
+        for posicion, (titular, enlace) in enumerate(site.extract(soup), start=1):
+            texto_nfd = unicodedata.normalize('NFD', titular)
+            titular_sin_tildes = re.sub(r'[\u0300-\u036f]', '', texto_nfd)
+            titulo_sin_caracteres = re.sub(r'[^A-Za-z0-9\s]', '', titular_sin_tildes)
+            titular_final = re.sub(r",", " ", titulo_sin_caracteres)
+
+            parts = enlace.split('/')
+            categoria = parts[3] if len(parts) > 3 else ''
+            noticias.append({
+                'Categoria': categoria,
+                'Titular': titular_final,
+                'Enlace': enlace,
+                'Posicion': posicion
+            })
+        periodico = site.name
+
         print(f"Total de noticias extraídas: {len(noticias)}")
         
-        # 4. Crear un CSV en memoria con las noticias
-        csv_buffer = io.StringIO()
-        escritor = csv.DictWriter(csv_buffer,fieldnames=['Categoria', 'Titular', 'Enlace'])
-        escritor.writeheader()
-        for noticia in noticias:
-            escritor.writerow(noticia)
-        
-        csv_key = f'final/periodico={periodico}/{datetime.now().strftime("year=%Y/month=%m/day=%d")}/{periodico}.csv'
-        
+        # 4. Comparar con la captura anterior del mismo periódico
+        ahora = datetime.now()
+        capturado = ahora.timestamp()
+        try:
+            previo = cargar_snapshot(bucket_name, periodico)
+        except (ClientError, BotoCoreError) as e:
+            print(f"Error al leer la captura anterior de {periodico}: {e}")
+            previo = False
+
+        indice = construir_indice(noticias, capturado, previo['noticias'] if previo else None)
+        cambios = diff_snapshots(previo['noticias'], indice, capturado, previo['capturado']) if previo else []
+        print(f"Total de cambios respecto a la captura anterior: {len(cambios)}")
+
+        particion = ahora.strftime("year=%Y/month=%m/day=%d")
+        csv_key = f'final/periodico={periodico}/{particion}/{periodico}.csv'
+        cambios_key = f'changes/periodico={periodico}/{particion}/{periodico}-{ahora.strftime("%H%M")}.csv'
+
         try:
-            # 6. Subir el CSV a S3
+            # 5. Subir el CSV con todas las noticias a S3
             s3.put_object(
                 Bucket=bucket_name,
                 Key=csv_key,
-                Body=csv_buffer.getvalue().encode('utf-8'),
+                Body=generar_csv(noticias, CAMPOS_NOTICIA),
                 ContentType='text/csv'
             )
         except Exception as e:
             print(f"Error al subir el CSV a {bucket_name}/{csv_key}: {e}")
             continue
+
+        # Si S3 falló al leer la captura anterior no se sobreescribe, para no
+        # perder el historial de permanencia por un error transitorio
+        if previo is False:
+            continue
+
+        try:
+            # 6. Subir solo los cambios y guardar el índice para la próxima captura
+            if cambios:
+                s3.put_object(
+                    Bucket=bucket_name,
+                    Key=cambios_key,
+                    Body=generar_csv(cambios, CAMPOS_CAMBIO),
+                    ContentType='text/csv'
+                )
+            s3.put_object(
+                Bucket=bucket_name,
+                Key=snapshot_key(periodico),
+                Body=json.dumps({'capturado': capturado, 'noticias': indice}).encode('utf-8'),
+                ContentType='application/json'
+            )
+        except Exception as e:
+            print(f"Error al guardar los cambios de {periodico} en {bucket_name}: {e}")
+            continue
     # 7. Retornar un mensaje de confirmación
     return {
         'statusCode': 200,
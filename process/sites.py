@@ -0,0 +1 @@
+../shared/sites.py
\ No newline at end of file
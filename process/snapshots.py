@@ -0,0 +1,101 @@
+from bisect import bisect_left
+
+
+def construir_indice(noticias, capturado, previo=None):
+    """
+    Indexa las noticias por Enlace. Si un enlace aparece varias veces en la
+    página se conserva la primera (mejor) posición. PrimeraVez se hereda del
+    índice previo para poder calcular el tiempo de permanencia.
+    """
+    previo = previo or {}
+    indice = {}
+    for noticia in noticias:
+        enlace = noticia['Enlace']
+        if enlace in indice:
+            continue
+        anterior = previo.get(enlace)
+        indice[enlace] = {
+            'Categoria': noticia['Categoria'],
+            'Titular': noticia['Titular'],
+            'Posicion': noticia['Posicion'],
+            'PrimeraVez': anterior['PrimeraVez'] if anterior else capturado,
+        }
+    return indice
+
+
+def _enlaces_estables(previo, actual):
+    """
+    Enlaces presentes en ambas capturas que forman la subsecuencia creciente
+    más larga de posiciones previas, recorridos en el orden actual. Son las
+    noticias que solo se desplazaron porque otras entraron, salieron o se
+    movieron. Se calcula en O(n log n).
+    """
+    comunes = [e for e in actual if e in previo]
+    posiciones = [previo[e]['Posicion'] for e in comunes]
+
+    colas = []       # colas[k]: índice del final de la mejor subsecuencia de largo k + 1
+    valores = []     # valores[k]: posición previa de colas[k], para la búsqueda binaria
+    anteriores = []  # anteriores[i]: índice del elemento anterior a i en su subsecuencia
+    for i, posicion in enumerate(posiciones):
+        k = bisect_left(valores, posicion)
+        anteriores.append(colas[k - 1] if k > 0 else -1)
+        if k == len(colas):
+            colas.append(i)
+            valores.append(posicion)
+        else:
+            colas[k] = i
+            valores[k] = posicion
+
+    estables = set()
+    i = colas[-1] if colas else -1
+    while i != -1:
+        estables.add(comunes[i])
+        i = anteriores[i]
+    return estables
+
+
+def diff_snapshots(previo, actual, capturado, capturado_previo):
+    """
+    Compara dos índices (ver construir_indice) y retorna solo los cambios:
+    noticias nuevas, movidas y que salieron de la portada. La permanencia de
+    las que salieron se mide hasta capturado_previo, la última vez que se vieron.
+
+    Una noticia se considera movida cuando queda fuera de la subsecuencia
+    más larga que conserva el orden previo, de modo que al subir una noticia
+    a la portada solo esa se marca, no todas las que quedan debajo. Tampoco
+    se reportan las que conservan su misma posición.
+    """
+    estables = _enlaces_estables(previo, actual)
+
+    cambios = []
+    for enlace, noticia in actual.items():
+        anterior = previo.get(enlace)
+        if anterior is None:
+            cambio = 'nuevo'
+        elif enlace not in estables and anterior['Posicion'] != noticia['Posicion']:
+            cambio = 'movido'
+        else:
+            continue
+        cambios.append({
+            'Cambio': cambio,
+            'Categoria': noticia['Categoria'],
+            'Titular': noticia['Titular'],
+            'Enlace': enlace,
+            'PosicionAnterior': anterior['Posicion'] if anterior else '',
+            'Posicion': noticia['Posicion'],
+            'Permanencia': int(capturado - noticia['PrimeraVez']),
+        })
+
+    for enlace, noticia in previo.items():
+        if enlace in actual:
+            continue
+        cambios.append({
+            'Cambio': 'salio',
+            'Categoria': noticia['Categoria'],
+            'Titular': noticia['Titular'],
+            'Enlace': enlace,
+            'PosicionAnterior': noticia['Posicion'],
+            'Posicion': '',
+            'Permanencia': int(capturado_previo - noticia['PrimeraVez']),
+        })
+    return cambios
@@ -3,7 +3,11 @@
 import pytest
 import json
 from unittest.mock import patch, MagicMock
+from botocore.exceptions import ClientError
 import app
+from sites import SiteRegistry
+from snapshots import construir_indice, diff_snapshots
+from bs4 import BeautifulSoup
 
 # Ejemplo de HTML de prueba para El Tiempo (2 artículos válidos)
 SAMPLE_HTML_ELTIEMPO = """
@@ -52,11 +56,35 @@ def patch_datetime(monkeypatch):
     # Sustituimos app.datetime por DummyDateTime
     monkeypatch.setattr(app, 'datetime', DummyDateTime)
 
+
+def _mock_get_object(mock_s3, html, snapshot=None):
+    """
+    get_object devuelve el HTML para las keys de raw/ y el índice de la
+    captura anterior (o NoSuchKey si no hay) para las de snapshots/.
+    """
+    def get_object(Bucket, Key):
+        if Key.startswith('snapshots/'):
+            if snapshot is None:
+                raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+            contenido = json.dumps(snapshot)
+        else:
+            contenido = html
+        body_mock = MagicMock()
+        body_mock.read.return_value = contenido.encode('utf-8')
+        return {'Body': body_mock}
+
+    mock_s3.get_object.side_effect = get_object
+
+
+def _put_calls(mock_s3, prefijo):
+    """Argumentos de las llamadas a put_object cuya Key empieza por prefijo."""
+    return [c[1] for c in mock_s3.put_object.call_args_list if c[1]['Key'].startswith(prefijo)]
+
 @patch('app.s3')
 def test_process_eltiempo_success(mock_s3, patch_datetime):
     """
     1) El key coincide con 'eltiempo', 2) get_object devuelve SAMPLE_HTML_ELTIEMPO,
-    3) Debe llamarse a put_object exactamente una vez con el CSV (header + 2 filas).
+    3) Debe subirse exactamente un CSV a final/ (header + 2 filas).
     """
     # Simulamos el evento S3 con key="eltiempo-2025-06-10.html"
     event = {
@@ -71,23 +99,21 @@ def test_process_eltiempo_success(mock_s3, patch_datetime):
     }
 
     # Mockeamos get_object para devolver el HTML de ejemplo
-    body_mock = MagicMock()
-    body_mock.read.return_value = SAMPLE_HTML_ELTIEMPO.encode('utf-8')
-    mock_s3.get_object.return_value = {'Body': body_mock}
+    _mock_get_object(mock_s3, SAMPLE_HTML_ELTIEMPO)
 
     # Ejecutamos la lambda
     response = app.lambda_handler(event, None)
 
     # Comprobamos que get_object se llamó con los parámetros correctos
-    mock_s3.get_object.assert_called_once_with(
+    mock_s3.get_object.assert_any_call(
         Bucket='headlines2025',
         Key='raw/eltiempo-2025-06-10.html'
     )
 
-    # Ahora debe invocar put_object exactamente una vez
-    assert mock_s3.put_object.call_count == 1
+    # Ahora debe subir exactamente un CSV a final/
+    assert len(_put_calls(mock_s3, 'final/')) == 1
 
-    put_args = mock_s3.put_object.call_args[1]
+    put_args = _put_calls(mock_s3, 'final/')[0]
     # Bucket debe ser el mismo
     assert put_args['Bucket'] == 'headlines2025'
     # El Key debe contener "periodico=eltiempo/year=2025/month=06/day=10/eltiempo.csv"
@@ -116,7 +142,7 @@ def test_process_eltiempo_success(mock_s3, patch_datetime):
 def test_process_publimetro_success(mock_s3, patch_datetime):
     """
     1) El key coincide con 'publimetro', 2) get_object devuelve SAMPLE_HTML_PUBLI.
-    3) Debe invocar put_object una vez con un CSV de 2 artículos + header.
+    3) Debe subir a final/ un CSV de 2 artículos + header.
     """
     event = {
         'Records': [
@@ -130,22 +156,20 @@ def test_process_publimetro_success(mock_s3, patch_datetime):
     }
 
     # Mock de get_object devolviendo SAMPLE_HTML_PUBLI
-    body_mock = MagicMock()
-    body_mock.read.return_value = SAMPLE_HTML_PUBLI.encode('utf-8')
-    mock_s3.get_object.return_value = {'Body': body_mock}
+    _mock_get_object(mock_s3, SAMPLE_HTML_PUBLI)
 
     response = app.lambda_handler(event, None)
 
     # Confirmamos que get_object recibió los parámetros correctos
-    mock_s3.get_object.assert_called_once_with(
+    mock_s3.get_object.assert_any_call(
         Bucket='headlines2025',
         Key='raw/publimetro-2025-06-10.html'
     )
 
-    # Debe invocar put_object EXACTAMENTE una vez
-    assert mock_s3.put_object.call_count == 1
+    # Debe subir EXACTAMENTE un CSV a final/
+    assert len(_put_calls(mock_s3, 'final/')) == 1
 
-    put_args = mock_s3.put_object.call_args[1]
+    put_args = _put_calls(mock_s3, 'final/')[0]
     # Verificamos que la key contenga "...periodico=publimetro/year=2025/month=06/day=10/publimetro.csv"
     assert 'final/periodico=publimetro/year=2025/month=06/day=10/publimetro.csv' in put_args['Key']
 
@@ -216,7 +240,7 @@ def test_process_get_object_error(mock_s3):
 def test_process_html_without_articles(mock_s3, patch_datetime):
     """
     HTML válido pero sin <article> → el código sigue, crea CSV con solo cabecera,
-    y sí invoca put_object UNA vez.
+    y sí sube UN CSV a final/
     """
     event = {
         'Records': [
@@ -230,22 +254,334 @@ def test_process_html_without_articles(mock_s3, patch_datetime):
     }
     # HTML sin ningún <article>
     html_sin_article = "<html><body><p>No hay artículos aquí</p></body></html>"
-    body_mock = MagicMock()
-    body_mock.read.return_value = html_sin_article.encode('utf-8')
-    mock_s3.get_object.return_value = {'Body': body_mock}
+    _mock_get_object(mock_s3, html_sin_article)
 
     response = app.lambda_handler(event, None)
 
-    # get_object se llamó, y put_object TAMBIÉN se llama una vez (ese CSV solo trae la cabecera)
-    mock_s3.get_object.assert_called_once()
-    assert mock_s3.put_object.call_count == 1
+    # get_object se llamó, y se sube UN CSV a final/ (ese CSV solo trae la cabecera)
+    mock_s3.get_object.assert_any_call(
+        Bucket='headlines2025',
+        Key='raw/eltiempo-2025-06-10.html'
+    )
+    assert len(_put_calls(mock_s3, 'final/')) == 1
 
-    put_args = mock_s3.put_object.call_args[1]
+    put_args = _put_calls(mock_s3, 'final/')[0]
     # Comprobamos que el Body del CSV solo contenga la cabecera
     body_str = put_args['Body'].decode('utf-8')
-    # splitlines() remueve el '\r\n' y nos queda solo la línea "Categoria,Titular,Enlace"
+    # splitlines() remueve el '\r\n' y nos queda solo la línea de cabecera
     filas = body_str.splitlines()
-    assert filas == ["Categoria,Titular,Enlace"]
+    assert filas == ["Categoria,Titular,Enlace,Posicion"]
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == 'Procesamiento de noticias completado.'
+
+@patch('app.s3')
+def test_process_unregistered_site(mock_s3):
+    """
+    Si el prefijo de la key no corresponde a ningún sitio del registro,
+    se omite sin descargar el HTML y el handler regresa statusCode 200.
+    """
+    event = {
+        'Records': [
+            {
+                's3': {
+                    'bucket': {'name': 'headlines2025'},
+                    'object': {'key': 'raw/desconocido-2025-06-10.html'}
+                }
+            }
+        ]
+    }
+
+    response = app.lambda_handler(event, None)
 
+    mock_s3.get_object.assert_not_called()
+    mock_s3.put_object.assert_not_called()
     assert response['statusCode'] == 200
-    assert json.loads(response['body']) == 'Procesamiento de noticias completado.'
\ No newline at end of file
+
+
+@patch('app.s3')
+def test_process_site_from_config(mock_s3, monkeypatch, patch_datetime):
+    """
+    Un periódico nuevo se agrega solo con configuración: el registro enruta
+    la key por su prefijo y aplica los selectores definidos para ese sitio.
+    """
+    registry = SiteRegistry.from_config([
+        {
+            'name': 'elespectador',
+            'url': 'https://www.elespectador.com',
+            'key_prefix': 'elespectador',
+            'base_url': 'https://www.elespectador.com',
+            'containers': [
+                {'selector': 'div.Card', 'title': '.Card-Title', 'link': 'a[href]'}
+            ]
+        }
+    ])
+    monkeypatch.setattr(app, 'REGISTRY', registry)
+
+    html = """
+    <div class="Card"><a href="/economia/noticia-uno"><span class="Card-Title">Economía, al día</span></a></div>
+    <div class="Card"><span class="Card-Title">Sin enlace</span></div>
+    """
+    _mock_get_object(mock_s3, html)
+
+    event = {
+        'Records': [
+            {
+                's3': {
+                    'bucket': {'name': 'headlines2025'},
+                    'object': {'key': 'raw/elespectador-2025-06-10.html'}
+                }
+            }
+        ]
+    }
+    app.lambda_handler(event, None)
+
+    put_args = _put_calls(mock_s3, 'final/')[0]
+    assert put_args['Key'] == 'final/periodico=elespectador/year=2025/month=06/day=10/elespectador.csv'
+    filas = put_args['Body'].decode('utf-8').splitlines()
+    assert filas == [
+        "Categoria,Titular,Enlace,Posicion",
+        "economia,Economia al dia,https://www.elespectador.com/economia/noticia-uno,1",
+    ]
+
+
+@patch('app.s3')
+def test_process_primera_captura(mock_s3, patch_datetime):
+    """
+    Sin captura anterior no se generan cambios: solo se guarda el índice
+    con la posición y la primera aparición de cada noticia.
+    """
+    _mock_get_object(mock_s3, SAMPLE_HTML_ELTIEMPO)
+    event = {
+        'Records': [
+            {
+                's3': {
+                    'bucket': {'name': 'headlines2025'},
+                    'object': {'key': 'raw/eltiempo-2025-06-10.html'}
+                }
+            }
+        ]
+    }
+
+    app.lambda_handler(event, None)
+
+    assert _put_calls(mock_s3, 'changes/') == []
+    snapshots = _put_calls(mock_s3, 'snapshots/')
+    assert [s['Key'] for s in snapshots] == ['snapshots/periodico=eltiempo/ultimo.json']
+    indice = json.loads(snapshots[0]['Body'].decode('utf-8'))['noticias']
+    assert [n['Posicion'] for n in indice.values()] == [1, 2]
+
+
+@patch('app.s3')
+def test_process_cambios_contra_captura_anterior(mock_s3, patch_datetime):
+    """
+    Con captura anterior se sube a changes/ solo lo que cambió: la noticia
+    nueva y la que salió de portada, con su tiempo de permanencia hasta la
+    última captura en que se vio.
+    """
+    capturado = app.datetime.now().timestamp()
+    snapshot = {
+        'capturado': capturado - 3600,
+        'noticias': {
+            'https://www.eltiempo.com/vida/noticia-ocho-234': {
+                'Categoria': 'vida', 'Titular': 'Vida Sana', 'Posicion': 1,
+                'PrimeraVez': capturado - 7200,
+            },
+            'https://www.eltiempo.com/deportes/noticia-vieja': {
+                'Categoria': 'deportes', 'Titular': 'Noticia vieja', 'Posicion': 2,
+                'PrimeraVez': capturado - 10800,
+            },
+        }
+    }
+    _mock_get_object(mock_s3, SAMPLE_HTML_ELTIEMPO, snapshot)
+    event = {
+        'Records': [
+            {
+                's3': {
+                    'bucket': {'name': 'headlines2025'},
+                    'object': {'key': 'raw/eltiempo-2025-06-10.html'}
+                }
+            }
+        ]
+    }
+
+    app.lambda_handler(event, None)
+
+    cambios = _put_calls(mock_s3, 'changes/')
+    assert [c['Key'] for c in cambios] == ['changes/periodico=eltiempo/year=2025/month=06/day=10/eltiempo-0000.csv']
+    filas = cambios[0]['Body'].decode('utf-8').splitlines()
+    assert filas == [
+        "Cambio,Categoria,Titular,Enlace,PosicionAnterior,Posicion,Permanencia",
+        "nuevo,politica,Politica Hoy Reforma Electoral Anunciada,https://www.eltiempo.com/politica/noticia-siete-901,,1,0",
+        "salio,deportes,Noticia vieja,https://www.eltiempo.com/deportes/noticia-vieja,2,,7200",
+    ]
+
+    # La noticia que sigue en portada conserva su primera aparición
+    indice = json.loads(_put_calls(mock_s3, 'snapshots/')[0]['Body'].decode('utf-8'))['noticias']
+    assert indice['https://www.eltiempo.com/vida/noticia-ocho-234']['PrimeraVez'] == capturado - 7200
+
+
+def _noticias(enlaces):
+    return [
+        {'Categoria': e, 'Titular': e.upper(), 'Enlace': e, 'Posicion': i}
+        for i, e in enumerate(enlaces, start=1)
+    ]
+
+
+def test_diff_snapshots_movidas():
+    """
+    Solo se marcan como movidas las noticias que rompen el orden previo; las
+    que se desplazan por la entrada de otra no cuentan. Un enlace repetido en
+    la página conserva su mejor posición.
+    """
+    previo = construir_indice(_noticias(['a', 'b', 'c']), 0)
+    actual = construir_indice(_noticias(['x', 'c', 'a', 'b', 'a']), 60, previo)
+
+    # a y b bajan solo por la entrada de x y la subida de c
+    cambios = diff_snapshots(previo, actual, 60, 0)
+    assert [(c['Cambio'], c['Enlace'], c['PosicionAnterior'], c['Posicion'], c['Permanencia']) for c in cambios] == [
+        ('nuevo', 'x', '', 1, 0),
+        ('movido', 'c', 3, 2, 60),
+    ]
+
+
+def test_diff_snapshots_promocion_a_portada():
+    """
+    Al subir una noticia del puesto 10 al 1 solo esa se marca como movida.
+    """
+    enlaces = list('abcdefghij')
+    previo = construir_indice(_noticias(enlaces), 0)
+    actual = construir_indice(_noticias(['j'] + enlaces[:-1]), 60, previo)
+
+    cambios = diff_snapshots(previo, actual, 60, 0)
+    assert [(c['Cambio'], c['Enlace'], c['PosicionAnterior'], c['Posicion']) for c in cambios] == [
+        ('movido', 'j', 10, 1),
+    ]
+
+
+def test_diff_snapshots_misma_posicion():
+    """
+    Una noticia que conserva su posición no se reporta aunque quede fuera de
+    la subsecuencia estable.
+    """
+    previo = construir_indice(_noticias(['a', 'b', 'c']), 0)
+    actual = construir_indice(_noticias(['c', 'b', 'a']), 60, previo)
+
+    cambios = diff_snapshots(previo, actual, 60, 0)
+    assert 'b' not in [c['Enlace'] for c in cambios]
+    assert all(c['PosicionAnterior'] != c['Posicion'] for c in cambios)
+
+
+def test_site_link_sin_href():
+    """
+    Si el selector de enlace no exige [href], los nodos cuyo enlace no tiene
+    href se omiten en lugar de lanzar KeyError.
+    """
+    registry = SiteRegistry.from_config([
+        {
+            'name': 'ejemplo',
+            'url': 'https://www.ejemplo.co',
+            'base_url': 'https://www.ejemplo.co',
+            'containers': [{'selector': 'article', 'title': 'h2', 'link': 'a'}]
+        }
+    ])
+    soup = BeautifulSoup(
+        '<article><h2>Sin href</h2><a name="ancla">x</a></article>'
+        '<article><h2>Con href</h2><a href="/pais/uno">x</a></article>',
+        'html.parser'
+    )
+
+    assert list(registry.get('ejemplo').extract(soup)) == [
+        ('Con href', 'https://www.ejemplo.co/pais/uno')
+    ]
+
+
+def test_site_varios_contenedores_en_orden_de_pagina():
+    """
+    Con varios contenedores los titulares salen en el orden de la página,
+    no agrupados por contenedor.
+    """
+    registry = SiteRegistry.from_config([
+        {
+            'name': 'ejemplo',
+            'url': 'https://www.ejemplo.co',
+            'containers': [
+                {'selector': 'article', 'title': 'h2', 'link': 'a[href]'},
+                {'selector': 'div.destacado', 'title': 'a', 'link': 'a[href]'}
+            ]
+        }
+    ])
+    soup = BeautifulSoup(
+        '<div class="destacado"><a href="https://www.ejemplo.co/uno">Uno</a></div>'
+        '<article><h2>Dos</h2><a href="https://www.ejemplo.co/dos">x</a></article>'
+        '<div class="destacado"><a href="https://www.ejemplo.co/tres">Tres</a></div>',
+        'html.parser'
+    )
+
+    assert [t for t, _ in registry.get('ejemplo').extract(soup)] == ['Uno', 'Dos', 'Tres']
+
+
+@pytest.mark.parametrize('contenido', [
+    '{"capturado": 0, "noticias": {"https://www.eltiempo.com/vida/noticia-ocho-234"',
+    '{"capturado": 0}',
+    '{"capturado": 0, "noticias": {"https://www.eltiempo.com/vida/noticia-ocho-234": {"Posicion": 1}}}',
+])
+@patch('app.s3')
+def test_process_captura_anterior_danada(mock_s3, patch_datetime, contenido):
+    """
+    Si ultimo.json está truncado o no tiene el formato esperado se trata como
+    primera captura: no se generan cambios y se vuelve a sembrar el índice.
+    """
+    def get_object(Bucket, Key):
+        body_mock = MagicMock()
+        body_mock.read.return_value = (contenido if Key.startswith('snapshots/') else SAMPLE_HTML_ELTIEMPO).encode('utf-8')
+        return {'Body': body_mock}
+    mock_s3.get_object.side_effect = get_object
+
+    event = {
+        'Records': [
+            {
+                's3': {
+                    'bucket': {'name': 'headlines2025'},
+                    'object': {'key': 'raw/eltiempo-2025-06-10.html'}
+                }
+            }
+        ]
+    }
+    response = app.lambda_handler(event, None)
+
+    assert response['statusCode'] == 200
+    assert _put_calls(mock_s3, 'changes/') == []
+    indice = json.loads(_put_calls(mock_s3, 'snapshots/')[0]['Body'].decode('utf-8'))['noticias']
+    assert len(indice) == 2
+
+
+@patch('app.s3')
+def test_process_error_s3_conserva_captura_anterior(mock_s3, patch_datetime):
+    """
+    Si S3 falla al leer ultimo.json (error transitorio) se sube el CSV de
+    final/ pero no se sobreescribe el índice anterior.
+    """
+    def get_object(Bucket, Key):
+        if Key.startswith('snapshots/'):
+            raise ClientError({'Error': {'Code': 'SlowDown'}}, 'GetObject')
+        body_mock = MagicMock()
+        body_mock.read.return_value = SAMPLE_HTML_ELTIEMPO.encode('utf-8')
+        return {'Body': body_mock}
+    mock_s3.get_object.side_effect = get_object
+
+    event = {
+        'Records': [
+            {
+                's3': {
+                    'bucket': {'name': 'headlines2025'},
+                    'object': {'key': 'raw/eltiempo-2025-06-10.html'}
+                }
+            }
+        ]
+    }
+    app.lambda_handler(event, None)
+
+    assert len(_put_calls(mock_s3, 'final/')) == 1
+    assert _put_calls(mock_s3, 'snapshots/') == []
+    assert _put_calls(mock_s3, 'changes/') == []
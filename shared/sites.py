@@ -0,0 +1,124 @@
+import json
+import os
+import re
+
+import soupsieve as sv
+
+# Ruta del archivo de configuración; se puede sobreescribir con SITES_CONFIG
+CONFIG_PATH = os.environ.get(
+    'SITES_CONFIG',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sites.json')
+)
+
+# Las keys de raw/ tienen la forma "<key_prefix>-YYYY-MM-DD.html"
+KEY_PATTERN = re.compile(r'^(?P<prefix>.+?)-\d{4}-\d{2}-\d{2}\.html$', re.IGNORECASE)
+
+
+class Container:
+    """
+    Contenedor de un titular dentro de la página. Los selectores CSS se
+    compilan una sola vez al cargar el registro.
+    """
+
+    def __init__(self, selector, title, link):
+        self.pattern = selector
+        self.selector = sv.compile(selector)
+        self.title = sv.compile(title)
+        self.link = sv.compile(link)
+
+    def extract_node(self, node):
+        """Retorna (titular, href) del nodo, o None si le falta alguno."""
+        t = self.title.select_one(node)
+        a = self.link.select_one(node)
+        href = a.get('href') if a else None
+        if not t or not href:
+            return None
+        return t.get_text(strip=True), href
+
+
+class Site:
+    """
+    Definición de un periódico: URL de descarga, prefijo de la key en S3
+    y reglas de extracción de titulares.
+    """
+
+    def __init__(self, name, url, key_prefix=None, base_url=None, containers=()):
+        self.name = name
+        self.url = url
+        self.key_prefix = (key_prefix or name).lower()
+        self.base_url = base_url or ''
+        self.containers = [Container(**c) for c in containers]
+        # Una sola consulta con todos los contenedores para recorrerlos en
+        # el orden en que aparecen en la página
+        self.selector = sv.compile(', '.join(c.pattern for c in self.containers)) if self.containers else None
+
+    def _container_for(self, node):
+        # Si un nodo coincide con varios contenedores gana el primero configurado
+        for container in self.containers:
+            if container.selector.match(node):
+                return container
+        return None
+
+    def extract(self, soup):
+        """
+        Devuelve (titular, enlace) por cada titular en el orden de la página,
+        con el enlace ya convertido en absoluto.
+        """
+        if self.selector is None:
+            return
+        for node in self.selector.select(soup):
+            extraido = self._container_for(node).extract_node(node)
+            if extraido is None:
+                continue
+            titular, enlace = extraido
+            if not enlace.startswith('http') and self.base_url:
+                enlace = self.base_url + enlace
+            yield titular, enlace
+
+
+class SiteRegistry:
+    """
+    Registro de sitios indexado por prefijo de key, para enrutar cada
+    objeto de S3 con una sola búsqueda en diccionario.
+    """
+
+    def __init__(self, sites):
+        self.sites = list(sites)
+        self._by_prefix = {}
+        for site in self.sites:
+            if site.key_prefix in self._by_prefix:
+                raise ValueError(f"Prefijo duplicado en el registro de sitios: {site.key_prefix}")
+            self._by_prefix[site.key_prefix] = site
+
+    def __iter__(self):
+        return iter(self.sites)
+
+    def __len__(self):
+        return len(self.sites)
+
+    def get(self, key_prefix):
+        return self._by_prefix.get(key_prefix.lower())
+
+    def for_key(self, object_key):
+        """
+        Retorna el Site al que pertenece la key (p. ej. raw/eltiempo-2025-06-10.html)
+        o None si ningún sitio registrado la reconoce.
+        """
+        filename = object_key.rsplit('/', 1)[-1]
+        match = KEY_PATTERN.match(filename)
+        if not match:
+            return None
+        return self.get(match.group('prefix'))
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(Site(**entry) for entry in config)
+
+    @classmethod
+    def from_file(cls, path=CONFIG_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_config(json.load(f))
+
+
+def load_registry(path=None):
+    return SiteRegistry.from_file(path or CONFIG_PATH)